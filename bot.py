@@ -1,8 +1,21 @@
 import os
+import re
+import time
+import asyncio
+import hashlib
 import logging
-import httpx
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackContext, CallbackQueryHandler
+import weakref
+import functools
+import importlib
+import importlib.util
+from dataclasses import dataclass
+import orjson
+import aiohttp
+from typing import Any, Awaitable, Callable, Iterator
+from telegram import Update, Chat, Message, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest, TelegramError
+from telegram.request import HTTPXRequest
+from telegram.ext import Application, PicklePersistence, CommandHandler, MessageHandler, filters, CallbackContext, CallbackQueryHandler
 import google.generativeai as genai
 from dotenv import load_dotenv
 
@@ -16,12 +29,45 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Response cache settings
+CACHE_TTL = 3600  # seconds
+CACHE_MAX_ENTRIES = 1000
+SEMANTIC_THRESHOLD = 0.92
+
+# Telegram caps messages at 4096 characters; leave room for a part counter
+MAX_MESSAGE_LENGTH = 4000
+MARKDOWN_CHARS = frozenset('*_`[')
+
+# Longest user message forwarded to the AIs
+MAX_PROMPT_LENGTH = 4000
+
+# Legacy Markdown: escaped characters, code spans/blocks, characters to escape
+MD_ESCAPED_RE = re.compile(r"\\[_*`\[]")
+MD_CODE_RE = re.compile(r"```.*?```|`[^`]+`", re.DOTALL)
+MD_SPECIAL_RE = re.compile(r"([_*`\[])")
+
+# Streamed replies: placeholder text, typing cursor and min seconds between edits
+STREAM_PLACEHOLDER = "🤖 …"
+STREAM_CURSOR = " ▌"
+STREAM_EDIT_INTERVAL = 1.0
+
+# Max in-flight calls per AI provider, and per user across providers
+PROVIDER_CONCURRENCY = 8
+USER_CONCURRENCY = 2
+
+# Seconds between typing indicator refreshes during long AI calls
+TYPING_REFRESH_INTERVAL = 4
+
+# Embedding model for the opt-in semantic cache tier
+SEMANTIC_MODEL = 'sentence-transformers/all-MiniLM-L6-v2'
+
 class AIChatBot:
-    def __init__(self):
+    def __init__(self) -> None:
         # Get tokens from environment variables
-        self.telegram_token = os.getenv('TELEGRAM_BOT_TOKEN')
+        self.telegram_token: str | None = os.getenv('TELEGRAM_BOT_TOKEN')
         
         # Initialize Gemini
+        self.gemini_model: genai.GenerativeModel | None
         gemini_api_key = os.getenv('GEMINI_API_KEY')
         if gemini_api_key and gemini_api_key != 'your_gemini_api_key_here':
             genai.configure(api_key=gemini_api_key)
@@ -30,35 +76,182 @@ class AIChatBot:
             self.gemini_model = None
             
         # Grok API key
-        self.grok_api_key = os.getenv('GROK_API_KEY')
+        self.grok_api_key: str | None = os.getenv('GROK_API_KEY')
         if self.grok_api_key == 'your_grok_api_key_here':
             self.grok_api_key = None
 
+        # Shared aiohttp session, created lazily inside the running event loop
+        self._session: aiohttp.ClientSession | None = None
+        
+        # Bound concurrent calls per provider to stay under rate limits
+        self._gemini_sem = asyncio.Semaphore(PROVIDER_CONCURRENCY)
+        self._grok_sem = asyncio.Semaphore(PROVIDER_CONCURRENCY)
+        
+        # Identical requests already in flight, keyed like the cache
+        self._inflight: dict[str, asyncio.Future[str]] = {}
+        
+        # Response cache: exact hits by hash, near-duplicates by embedding
+        self._cache: dict[str, tuple[float, str]] = {}
+        self._semantic_cache: list[tuple[float, str, object, str]] = []
+        # The semantic tier is opt-in (SEMANTIC_CACHE=1, needs sentence-transformers)
+        # because it answers similar prompts with another user's cached reply
+        self._semantic = os.getenv('SEMANTIC_CACHE') == '1'
+        if self._semantic and importlib.util.find_spec('sentence_transformers') is None:
+            logger.warning("SEMANTIC_CACHE is set but sentence-transformers is not installed")
+            self._semantic = False
+        self._embedder: Any = None
+        self._embedder_lock = asyncio.Lock()
+        self._embed: Callable[[str], Any]
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Return the shared Grok session, creating it on first use"""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                headers={
+                    "Authorization": f"Bearer {self.grok_api_key}",
+                    "Content-Type": "application/json"
+                },
+                # Streamed replies can run long, so bound idle reads rather than the total
+                timeout=aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=30),
+                connector=aiohttp.TCPConnector(limit=100, ttl_dns_cache=300, keepalive_timeout=60)
+            )
+        return self._session
+
+    async def aclose(self) -> None:
+        """Close the shared HTTP session"""
+        if self._session is not None:
+            await self._session.close()
+
+    @staticmethod
+    def _cache_key(model: str, message: str) -> str:
+        return hashlib.sha256(f"{model}|{message}".encode()).hexdigest()
+
+    @staticmethod
+    def _load_embedder() -> Any:
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(SEMANTIC_MODEL)
+
+    async def _embed_message(self, message: str) -> Any:
+        """Embed a message, loading the model off the event loop on first use"""
+        async with self._embedder_lock:
+            if self._embedder is None:
+                self._embedder = await asyncio.to_thread(self._load_embedder)
+                self._embed = functools.lru_cache(maxsize=256)(self._encode)
+        return await asyncio.to_thread(self._embed, message)
+
+    def _encode(self, message: str) -> Any:
+        """Normalized sentence embedding, so a dot product is the cosine"""
+        return self._embedder.encode(message, normalize_embeddings=True)
+
+    async def _cache_get(self, model: str, message: str) -> str | None:
+        """Look up a cached response, exact match first then semantic"""
+        now = time.monotonic()
+        key = self._cache_key(model, message)
+        entry = self._cache.get(key)
+        if entry is not None:
+            if now - entry[0] < CACHE_TTL:
+                return entry[1]
+            del self._cache[key]
+        
+        if not self._semantic:
+            return None
+        
+        self._semantic_cache = [e for e in self._semantic_cache if now - e[0] < CACHE_TTL]
+        if not any(e[1] == model for e in self._semantic_cache):
+            return None
+        
+        vec = await self._embed_message(message)
+        best_score: float = 0.0
+        best_response: str | None = None
+        for _, cached_model, cached_vec, cached_response in self._semantic_cache:
+            if cached_model == model:
+                score = float(vec @ cached_vec)
+                if score > best_score:
+                    best_score, best_response = score, cached_response
+        if best_score > SEMANTIC_THRESHOLD:
+            return best_response
+        return None
+
+    async def _cache_put(self, model: str, message: str, response: str) -> None:
+        """Store a successful response in the cache"""
+        now = time.monotonic()
+        self._cache[self._cache_key(model, message)] = (now, response)
+        if len(self._cache) > CACHE_MAX_ENTRIES:
+            # Dicts keep insertion order, so the first key is the oldest
+            del self._cache[next(iter(self._cache))]
+        
+        if self._semantic:
+            vec = await self._embed_message(message)
+            self._semantic_cache.append((now, model, vec, response))
+            del self._semantic_cache[:-CACHE_MAX_ENTRIES]
+
+    async def _coalesce(self, key: str, call: Callable[[], Awaitable[str]]) -> str:
+        """Share one upstream call between concurrent identical requests"""
+        while (pending := self._inflight.get(key)) is not None:
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                # If the caller that made the request was cancelled rather
+                # than us, retry: join a newer request or make our own
+                if not pending.cancelled():
+                    raise
+        
+        future: asyncio.Future[str] = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await call()
+        except BaseException:
+            future.cancel()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._inflight[key]
+
     async def gemini_chat(self, message: str) -> str:
         """Gemini implementation"""
+        key = self._cache_key('gemini-pro', message)
+        return await self._coalesce(key, lambda: self._gemini_request(message))
+
+    async def _gemini_request(self, message: str) -> str:
+        """Call Gemini, answering from the cache when possible"""
         if not self.gemini_model:
             return "❌ Gemini API key not configured. Please add GEMINI_API_KEY to environment variables."
             
         try:
-            response = self.gemini_model.generate_content(message)
+            cached = await self._cache_get('gemini-pro', message)
+            if cached is not None:
+                return cached
+            
+            async with self._gemini_sem:
+                response = await self.gemini_model.generate_content_async(message)
+            await self._cache_put('gemini-pro', message, response.text)
             return response.text
         except Exception as e:
-            logger.error(f"Gemini Error: {e}")
+            logger.error("Gemini Error: %s", e)
             return f"❌ Gemini Error: {str(e)}"
 
-    async def grok_chat(self, message: str) -> str:
-        """Grok AI implementation"""
+    async def grok_chat(self, message: str, on_delta: Callable[[str], Awaitable[None]] | None = None) -> str:
+        """Grok AI implementation, passing each streamed text delta to on_delta"""
+        # Callers joining an in-flight request only get the final text
+        key = self._cache_key('grok-beta', message)
+        return await self._coalesce(key, lambda: self._grok_request(message, on_delta))
+
+    async def _grok_request(self, message: str, on_delta: Callable[[str], Awaitable[None]] | None) -> str:
+        """Stream a reply from Grok, answering from the cache when possible"""
         if not self.grok_api_key:
             return "❌ Grok API key not configured. Please add GROK_API_KEY to environment variables."
             
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
+            cached = await self._cache_get('grok-beta', message)
+            if cached is not None:
+                return cached
+            
+            parts: list[str] = []
+            async with self._grok_sem:
+                async with self._get_session().post(
                     "https://api.x.ai/v1/chat/completions",
-                    headers={
-                        "Content-Type": "application/json",
-                        "Authorization": f"Bearer {self.grok_api_key}"
-                    },
                     json={
                         "messages": [
                             {
@@ -71,40 +264,76 @@ class AIChatBot:
                             }
                         ],
                         "model": "grok-beta",
-                        "stream": False,
+                        "stream": True,
                         "temperature": 0.7
-                    },
-                    timeout=30.0
-                )
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    return data['choices'][0]['message']['content']
-                else:
-                    return f"❌ Grok API Error: {response.status_code} - {response.text}"
+                    }
+                ) as response:
+                    if response.status != 200:
+                        return f"❌ Grok API Error: {response.status} - {await response.text()}"
                     
+                    # Server-sent events: one "data: {...}" frame per line
+                    async for line in response.content:
+                        line = line.strip()
+                        if not line.startswith(b"data:"):
+                            continue
+                        payload = line[5:].strip()
+                        if payload == b"[DONE]":
+                            break
+                        delta = orjson.loads(payload)['choices'][0]['delta'].get('content')
+                        if delta:
+                            parts.append(delta)
+                            if on_delta is not None:
+                                await on_delta(delta)
+            
+            content = "".join(parts)
+            if content:
+                await self._cache_put('grok-beta', message, content)
+            return content
+                
         except Exception as e:
-            logger.error(f"Grok Error: {e}")
+            logger.error("Grok Error: %s", e)
             return f"❌ Grok Error: {str(e)}"
 
 # Initialize the bot
 ai_bot = AIChatBot()
 
-async def start(update: Update, context: CallbackContext) -> None:
-    """Send welcome message with beautiful AI selection buttons"""
-    keyboard = [
-        [
-            InlineKeyboardButton("🔷 Gemini Pro", callback_data="gemini"),
-            InlineKeyboardButton("🤖 Grok AI", callback_data="grok"),
-        ],
-        [
-            InlineKeyboardButton("🔄 Both AIs", callback_data="both_ai"),
-            InlineKeyboardButton("ℹ️ Help", callback_data="help"),
-        ]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    welcome_text = """
+@dataclass(slots=True)
+class UserState:
+    """Per-user settings, stored as a single slotted object in user_data"""
+    ai_choice: str = 'gemini'
+
+    def __reduce__(self) -> tuple[Any, ...]:
+        # Pickle by value so mypyc-compiled and interpreted builds can read
+        # each other's persisted state
+        return (UserState, (self.ai_choice,))
+
+# Kept out of user_data so it isn't persisted; an entry lives only while in use
+_user_sems: weakref.WeakValueDictionary[int, asyncio.Semaphore] = weakref.WeakValueDictionary()
+
+def _user_semaphore(user_id: int) -> asyncio.Semaphore:
+    """Return the semaphore bounding one user's concurrent AI calls"""
+    sem = _user_sems.get(user_id)
+    if sem is None:
+        sem = asyncio.Semaphore(USER_CONCURRENCY)
+        _user_sems[user_id] = sem
+    return sem
+
+def _state(context: CallbackContext) -> UserState:
+    """Return the user's state, creating it on first use"""
+    state = context.user_data.get('state')
+    # Replace anything unusable, e.g. state persisted by an older layout
+    if not isinstance(state, UserState) or getattr(state, 'ai_choice', None) not in AI_INFO:
+        state = UserState()
+        context.user_data['state'] = state
+    return state
+
+# Single-AI dispatch for _generate_reply; Grok-only replies are streamed
+# by handle_message instead
+AI_HANDLERS = {'gemini': ai_bot.gemini_chat}
+AI_HEADERS = {'gemini': "🔷 *Gemini Pro:*", 'grok': "🤖 *Grok AI:*"}
+
+# Static messages and keyboards, built once at import time
+WELCOME_TEXT = """
 🌟 *Welcome to AI Assistant Bot!* 🌟
 
 I'm your intelligent assistant powered by two amazing AI models:
@@ -122,13 +351,9 @@ I'm your intelligent assistant powered by two amazing AI models:
 • Knowledge sharing
 
 ✨ *Choose your AI companion below and let's create magic together!* ✨
-    """
-    
-    await update.message.reply_text(welcome_text, reply_markup=reply_markup, parse_mode='Markdown')
+"""
 
-async def help_command(update: Update, context: CallbackContext) -> None:
-    """Send help message"""
-    help_text = """
+HELP_TEXT = """
 🆘 *Help Guide* 🆘
 
 *Available Commands:*
@@ -155,15 +380,157 @@ async def help_command(update: Update, context: CallbackContext) -> None:
 • Both AIs maintain conversation context
 
 *Need Help?* Just type your question and I'll assist you! 🚀
-    """
-    
-    keyboard = [
-        [InlineKeyboardButton("🚀 Start Chatting", callback_data="start_chat")],
-        [InlineKeyboardButton("🔷 Gemini", callback_data="gemini"), InlineKeyboardButton("🤖 Grok", callback_data="grok")]
+"""
+
+ERROR_TEXT = """
+❌ *Oops! Something went wrong.*
+
+Please try one of these:
+1. 🔄 Use /switch to change AI
+2. 📝 Rephrase your question
+3. ⏰ Try again in a moment
+
+If the problem continues, use /help for assistance.
+"""
+
+AI_INFO = {
+    'gemini': {
+        'name': '🔷 Gemini Pro',
+        'color': '#4285F4',
+        'description': 'Google\'s most advanced AI model'
+    },
+    'grok': {
+        'name': '🤖 Grok AI', 
+        'color': '#FF6B35',
+        'description': 'xAI\'s powerful conversational AI'
+    },
+    'both_ai': {
+        'name': '🔄 Both AIs',
+        'color': '#9C27B0',
+        'description': 'Get responses from both Gemini and Grok'
+    }
+}
+
+CONFIRMATIONS = {
+    ai_choice: f"""
+✅ *AI Selected: {info['name']}*
+
+{info['description']}
+
+💡 *Now you can start chatting!* Send me any message and I'll respond using {info['name']}.
+
+🎯 *Examples you can try:*
+• "Explain quantum computing"
+• "Write a Python script for web scraping"  
+• "Help me plan a trip to Japan"
+• "What's the latest in AI research?"
+
+✨ *Ready when you are!* ✨
+"""
+    for ai_choice, info in AI_INFO.items()
+}
+
+MAIN_KB = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("🔷 Gemini Pro", callback_data="gemini"),
+        InlineKeyboardButton("🤖 Grok AI", callback_data="grok"),
+    ],
+    [
+        InlineKeyboardButton("🔄 Both AIs", callback_data="both_ai"),
+        InlineKeyboardButton("ℹ️ Help", callback_data="help"),
     ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    await update.message.reply_text(help_text, reply_markup=reply_markup, parse_mode='Markdown')
+])
+
+HELP_KB = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🚀 Start Chatting", callback_data="start_chat")],
+    [InlineKeyboardButton("🔷 Gemini", callback_data="gemini"), InlineKeyboardButton("🤖 Grok", callback_data="grok")]
+])
+
+CONFIRM_KB = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📝 Start Chatting", callback_data="start_chat")],
+    [InlineKeyboardButton("🔄 Switch AI", callback_data="switch_ai")]
+])
+
+RESPONSE_KB = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("🔄 Switch AI", callback_data="switch_ai"),
+        InlineKeyboardButton("❓ New Question", callback_data="new_question")
+    ]
+])
+
+STATUS_KB = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🔄 Switch AI", callback_data="switch_ai")],
+    [InlineKeyboardButton("🚀 Start Chatting", callback_data="start_chat")]
+])
+
+async def _typing_refresher(chat: Chat) -> None:
+    """Re-send the typing action before Telegram's ~5 second indicator expires"""
+    try:
+        while True:
+            await asyncio.sleep(TYPING_REFRESH_INTERVAL)
+            await chat.send_action(action="typing")
+    except TelegramError:
+        pass
+
+def _chunk(text: str, n: int = MAX_MESSAGE_LENGTH) -> Iterator[str]:
+    """Yield pieces of at most n chars, splitting on paragraph or line breaks"""
+    # Leading breaks would otherwise be picked as a split point, yielding a blank part
+    text = text.lstrip("\n")
+    while len(text) > n:
+        cut = text.rfind("\n\n", 0, n)
+        if cut <= 0:
+            cut = text.rfind("\n", 0, n)
+        if cut <= 0:
+            cut = n
+        yield text[:cut]
+        text = text[cut:].lstrip("\n")
+    if text:
+        yield text
+
+def _markdown_ok(text: str) -> bool:
+    """Cheap check that legacy Markdown entities in text are balanced"""
+    text = MD_CODE_RE.sub("", MD_ESCAPED_RE.sub("", text))
+    return (
+        "`" not in text
+        and text.count("*") % 2 == 0
+        and text.count("_") % 2 == 0
+        and text.count("[") == text.count("]")
+    )
+
+def _escape_markdown(text: str) -> str:
+    """Escape Markdown characters outside code spans and blocks"""
+    parts: list[str] = []
+    last = 0
+    for match in MD_CODE_RE.finditer(text):
+        parts.append(MD_SPECIAL_RE.sub(r"\\\1", text[last:match.start()]))
+        parts.append(match.group())
+        last = match.end()
+    parts.append(MD_SPECIAL_RE.sub(r"\\\1", text[last:]))
+    return "".join(parts)
+
+def _format_reply(ai_choice: str, response: str) -> str:
+    """Add the AI header, escaping a response whose Markdown wouldn't parse"""
+    if not _markdown_ok(response):
+        response = _escape_markdown(response)
+    return f"{AI_HEADERS[ai_choice]}\n{response}"
+
+async def _send_markdown(send: Callable[..., Awaitable[Any]], text: str, **kwargs: Any) -> None:
+    """Send text as Markdown when it parses, falling back to plain text once"""
+    if MARKDOWN_CHARS.intersection(text) and _markdown_ok(text):
+        try:
+            await send(text, parse_mode='Markdown', **kwargs)
+            return
+        except BadRequest as e:
+            logger.warning("Markdown rejected, resending as plain text: %s", e)
+    await send(text, **kwargs)
+
+async def start(update: Update, context: CallbackContext) -> None:
+    """Send welcome message with beautiful AI selection buttons"""
+    await update.effective_message.reply_text(WELCOME_TEXT, reply_markup=MAIN_KB, parse_mode='Markdown')
+
+async def help_command(update: Update, context: CallbackContext) -> None:
+    """Send help message"""
+    await update.effective_message.reply_text(HELP_TEXT, reply_markup=HELP_KB, parse_mode='Markdown')
 
 async def button_handler(update: Update, context: CallbackContext) -> None:
     """Handle button clicks"""
@@ -172,134 +539,159 @@ async def button_handler(update: Update, context: CallbackContext) -> None:
     
     choice = query.data
     
-    if choice == "help":
-        await help_command(update, context)
-        return
-    elif choice == "start_chat":
-        await start(update, context)
-        return
+    action = CALLBACK_ACTIONS.get(choice)
+    if action:
+        return await action(update, context)
     
     # AI selection
     ai_choice = choice
-    context.user_data['ai_choice'] = ai_choice
-    
-    ai_info = {
-        'gemini': {
-            'name': '🔷 Gemini Pro',
-            'color': '#4285F4',
-            'description': 'Google\'s most advanced AI model'
-        },
-        'grok': {
-            'name': '🤖 Grok AI', 
-            'color': '#FF6B35',
-            'description': 'xAI\'s powerful conversational AI'
-        },
-        'both_ai': {
-            'name': '🔄 Both AIs',
-            'color': '#9C27B0',
-            'description': 'Get responses from both Gemini and Grok'
-        }
-    }
-    
-    selected_ai = ai_info[ai_choice]
+    if ai_choice not in CONFIRMATIONS:
+        return
+    _state(context).ai_choice = ai_choice
     
-    confirmation_text = f"""
-✅ *AI Selected: {selected_ai['name']}*
-
-{selected_ai['description']}
-
-💡 *Now you can start chatting!* Send me any message and I'll respond using {selected_ai['name']}.
+    await query.edit_message_text(CONFIRMATIONS[ai_choice], reply_markup=CONFIRM_KB, parse_mode='Markdown')
 
-🎯 *Examples you can try:*
-• "Explain quantum computing"
-• "Write a Python script for web scraping"  
-• "Help me plan a trip to Japan"
-• "What's the latest in AI research?"
+async def _generate_reply(ai_choice: str, user_message: str) -> str:
+    """Query the selected AI(s) and format the reply"""
+    if ai_choice == 'both_ai':
+        # Query both AIs concurrently
+        gemini_response, grok_response = await asyncio.gather(
+            ai_bot.gemini_chat(user_message),
+            ai_bot.grok_chat(user_message),
+            return_exceptions=True
+        )
+        
+        if isinstance(gemini_response, BaseException):
+            logger.error("Gemini Error: %s", gemini_response)
+            gemini_response = f"❌ Gemini Error: {str(gemini_response)}"
+        if isinstance(grok_response, BaseException):
+            logger.error("Grok Error: %s", grok_response)
+            grok_response = f"❌ Grok Error: {str(grok_response)}"
+        
+        responses = [
+            _format_reply('gemini', gemini_response),
+            _format_reply('grok', grok_response)
+        ]
+        
+        return "\n\n" + "═" * 30 + "\n\n".join(responses)
+    
+    response = await AI_HANDLERS[ai_choice](user_message)
+    return _format_reply(ai_choice, response)
 
-✨ *Ready when you are!* ✨
-    """
+async def _stream_grok_reply(placeholder: Message, user_message: str) -> str:
+    """Edit the placeholder with Grok's partial reply, returning the full reply"""
+    parts: list[str] = []
+    last_edit = time.monotonic()
+    edit_task: asyncio.Task[None] | None = None
     
-    keyboard = [
-        [InlineKeyboardButton("📝 Start Chatting", callback_data="start_chat")],
-        [InlineKeyboardButton("🔄 Switch AI", callback_data="switch_ai")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    async def edit(text: str) -> None:
+        try:
+            # Partial text may have unbalanced Markdown, so send it plain
+            await placeholder.edit_text(text + STREAM_CURSOR)
+        except TelegramError as e:
+            logger.debug("Skipping stream edit: %s", e)
+    
+    async def on_delta(delta: str) -> None:
+        nonlocal last_edit, edit_task
+        parts.append(delta)
+        now = time.monotonic()
+        # Debounce edits to stay under Telegram's per-chat edit rate limit
+        if now - last_edit < STREAM_EDIT_INTERVAL:
+            return
+        # Edits run in the background so the stream never waits on Telegram;
+        # skip this one if the previous edit is still in flight
+        if edit_task is not None and not edit_task.done():
+            return
+        text = "".join(parts)
+        if len(text) > MAX_MESSAGE_LENGTH:
+            return
+        last_edit = now
+        edit_task = asyncio.create_task(edit(text))
     
-    await query.edit_message_text(confirmation_text, reply_markup=reply_markup, parse_mode='Markdown')
+    try:
+        grok_response = await ai_bot.grok_chat(user_message, on_delta)
+    except BaseException:
+        if edit_task is not None:
+            edit_task.cancel()
+        raise
+    
+    if edit_task is not None:
+        # Let the last partial edit land so it can't overwrite the final reply
+        await edit_task
+    return _format_reply('grok', grok_response)
+
+async def _send_reply(update: Update, final_response: str, placeholder: Message | None = None) -> None:
+    """Send the final reply, replacing the streaming placeholder if there is one"""
+    # Split long messages (Telegram has 4096 character limit)
+    if len(final_response) > MAX_MESSAGE_LENGTH:
+        if placeholder:
+            await placeholder.delete()
+        chunks = list(_chunk(final_response))
+        total = len(chunks)
+        # Sent concurrently, so number the parts in case they arrive out of order
+        await asyncio.gather(*(
+            _send_markdown(update.message.reply_text, f"({i}/{total})\n{chunk}")
+            for i, chunk in enumerate(chunks, 1)
+        ))
+    elif placeholder:
+        await _send_markdown(placeholder.edit_text, final_response, reply_markup=RESPONSE_KB)
+    else:
+        # Add quick action buttons
+        await _send_markdown(update.message.reply_text, final_response, reply_markup=RESPONSE_KB)
 
 async def handle_message(update: Update, context: CallbackContext) -> None:
     """Handle user messages"""
     user_message = update.message.text
     user_id = update.message.from_user.id
     
+    # Don't pay for a full AI call on pathological prompts
+    if len(user_message) > MAX_PROMPT_LENGTH:
+        await update.message.reply_text(
+            f"✂️ Message too long — please keep it to at most {MAX_PROMPT_LENGTH} characters."
+        )
+        return
+    
     # Get AI choice from user data
-    ai_choice = context.user_data.get('ai_choice', 'gemini')
+    ai_choice = _state(context).ai_choice
     
     # Show typing action
     await update.message.chat.send_action(action="typing")
     
+    placeholder: Message | None = None
     try:
-        if ai_choice == 'both_ai':
-            # Get responses from both AIs
-            responses = []
-            
-            # Gemini
-            await update.message.chat.send_action(action="typing")
-            gemini_response = await ai_bot.gemini_chat(user_message)
-            responses.append(f"🔷 *Gemini Pro:*\n{gemini_response}")
-            
-            # Grok
-            await update.message.chat.send_action(action="typing")
-            grok_response = await ai_bot.grok_chat(user_message)
-            responses.append(f"🤖 *Grok AI:*\n{grok_response}")
-            
-            final_response = "\n\n" + "═" * 30 + "\n\n".join(responses)
-            
-        elif ai_choice == 'gemini':
-            gemini_response = await ai_bot.gemini_chat(user_message)
-            final_response = f"🔷 *Gemini Pro:*\n{gemini_response}"
-            
-        elif ai_choice == 'grok':
-            grok_response = await ai_bot.grok_chat(user_message)
-            final_response = f"🤖 *Grok AI:*\n{grok_response}"
+        # Keep the typing indicator alive while the AI is working
+        typing = asyncio.create_task(_typing_refresher(update.message.chat))
+        try:
+            # Stop one user from monopolizing the AI providers
+            async with _user_semaphore(user_id):
+                if ai_choice == 'grok':
+                    # Show Grok's reply growing in a placeholder message
+                    placeholder = await update.message.reply_text(STREAM_PLACEHOLDER)
+                    final_response = await _stream_grok_reply(placeholder, user_message)
+                else:
+                    final_response = await _generate_reply(ai_choice, user_message)
+        finally:
+            typing.cancel()
         
-        # Split long messages (Telegram has 4096 character limit)
-        if len(final_response) > 4000:
-            for i in range(0, len(final_response), 4000):
-                await update.message.reply_text(
-                    final_response[i:i+4000], 
-                    parse_mode='Markdown'
-                )
-        else:
-            # Add quick action buttons
-            keyboard = [
-                [
-                    InlineKeyboardButton("🔄 Switch AI", callback_data="switch_ai"),
-                    InlineKeyboardButton("❓ New Question", callback_data="new_question")
-                ]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await update.message.reply_text(final_response, parse_mode='Markdown', reply_markup=reply_markup)
+        await _send_reply(update, final_response, placeholder)
             
     except Exception as e:
-        logger.error(f"Error processing message: {e}")
-        error_text = """
-❌ *Oops! Something went wrong.*
-
-Please try one of these:
-1. 🔄 Use /switch to change AI
-2. 📝 Rephrase your question
-3. ⏰ Try again in a moment
-
-If the problem continues, use /help for assistance.
-        """
-        await update.message.reply_text(error_text, parse_mode='Markdown')
+        logger.error("Error processing message: %s", e)
+        if placeholder is not None:
+            # Don't leave a half-streamed reply behind the error message
+            try:
+                await placeholder.delete()
+            except TelegramError:
+                pass
+        await update.message.reply_text(ERROR_TEXT, parse_mode='Markdown')
 
 async def switch_ai(update: Update, context: CallbackContext) -> None:
     """Switch between AIs"""
     await start(update, context)
 
+# Callback buttons that trigger a handler rather than select an AI
+CALLBACK_ACTIONS = {'help': help_command, 'start_chat': start, 'switch_ai': switch_ai}
+
 async def status_command(update: Update, context: CallbackContext) -> None:
     """Check AI services status"""
     status_text = """
@@ -318,7 +710,7 @@ async def status_command(update: Update, context: CallbackContext) -> None:
     else:
         status_text += "🤖 *Grok AI:* ❌ Not configured\n"
     
-    ai_choice = context.user_data.get('ai_choice', 'gemini')
+    ai_choice = _state(context).ai_choice
     ai_names = {'gemini': 'Gemini Pro', 'grok': 'Grok AI', 'both_ai': 'Both AIs'}
     
     status_text += f"\n💡 *Current Selection:* *{ai_names[ai_choice]}*\n\n"
@@ -328,13 +720,11 @@ async def status_command(update: Update, context: CallbackContext) -> None:
     else:
         status_text += "⚠️ Some services are not configured. Check environment variables."
     
-    keyboard = [
-        [InlineKeyboardButton("🔄 Switch AI", callback_data="switch_ai")],
-        [InlineKeyboardButton("🚀 Start Chatting", callback_data="start_chat")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    await update.message.reply_text(status_text, parse_mode='Markdown', reply_markup=reply_markup)
+    await update.message.reply_text(status_text, parse_mode='Markdown', reply_markup=STATUS_KB)
+
+async def shutdown(application: Application) -> None:
+    """Release shared resources on shutdown"""
+    await ai_bot.aclose()
 
 def main() -> None:
     """Start the bot"""
@@ -342,8 +732,40 @@ def main() -> None:
         logger.error("TELEGRAM_BOT_TOKEN not found in environment variables")
         return
     
+    # Use uvloop's faster event loop where available (not on Windows)
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
+    
     # Create Application
-    application = Application.builder().token(ai_bot.telegram_token).build()
+    # Pooled HTTP/2 clients for outgoing calls and for getUpdates polling
+    request = HTTPXRequest(
+        connection_pool_size=100,
+        http_version="2",
+        read_timeout=30,
+        write_timeout=30,
+        connect_timeout=10
+    )
+    get_updates_request = HTTPXRequest(connection_pool_size=10, http_version="2")
+    
+    # Persist user settings (e.g. the chosen AI) across restarts
+    persistence = PicklePersistence(
+        filepath=os.getenv('PERSISTENCE_FILE', 'bot_state.pkl'),
+        update_interval=60
+    )
+    
+    application = (
+        Application.builder()
+        .token(ai_bot.telegram_token)
+        .request(request)
+        .get_updates_request(get_updates_request)
+        .persistence(persistence)
+        .concurrent_updates(True)
+        .post_shutdown(shutdown)
+        .build()
+    )
     
     # Add handlers
     application.add_handler(CommandHandler("start", start))
@@ -355,11 +777,33 @@ def main() -> None:
     
     # Start the Bot
     logger.info("🤖 Bot is starting...")
-    logger.info("🔷 Gemini: " + ("✅ Configured" if ai_bot.gemini_model else "❌ Not configured"))
-    logger.info("🤖 Grok: " + ("✅ Configured" if ai_bot.grok_api_key else "❌ Not configured"))
+    logger.info("🔷 Gemini: %s", "✅ Configured" if ai_bot.gemini_model else "❌ Not configured")
+    logger.info("🤖 Grok: %s", "✅ Configured" if ai_bot.grok_api_key else "❌ Not configured")
     logger.info("🚀 Bot is ready! Visit: t.me/btheai_abot")
     
-    application.run_polling()
+    # Only receive the update types we handle
+    allowed_updates = [Update.MESSAGE, Update.CALLBACK_QUERY]
+    
+    webhook_url = os.getenv('WEBHOOK_URL')
+    if webhook_url:
+        # Telegram pushes updates to us instead of being polled
+        application.run_webhook(
+            listen="0.0.0.0",
+            port=int(os.getenv('PORT', '8443')),
+            webhook_url=webhook_url,
+            secret_token=os.getenv('WEBHOOK_SECRET'),
+            allowed_updates=allowed_updates
+        )
+    else:
+        # Long-poll so idle periods don't cost constant getUpdates round-trips
+        application.run_polling(poll_interval=0, timeout=30, allowed_updates=allowed_updates)
 
 if __name__ == '__main__':
-    main()
+    # Run from the importable module so persisted UserState objects are
+    # pickled as bot.UserState, not __main__.UserState (imported
+    # dynamically, as mypyc can't compile a static self-import).
+    # This executes the module a second time: the module-level objects of
+    # this __main__ copy (ai_bot, caches, keyboards) are unused, and its
+    # side effects (load_dotenv, logging.basicConfig, genai.configure) are
+    # safe to repeat. Prefer `python -c "from bot import main; main()"`.
+    importlib.import_module('bot').main()